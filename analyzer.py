@@ -1,12 +1,25 @@
+import os
+import pickle
+import shutil
+import tempfile
 import uuid
 from copy import deepcopy
 from dataclasses import dataclass, field
 from enum import Enum
 from typing import Dict, List, Tuple
 
+import numpy as np
+
 from bootstrapnode import BootstrapNode
 from fullnode import FullNode, Exchange
-from plotter import violin_plot, grouped_bar_plot, heat_map, stacked_bar_plot
+from plotter import violin_plot, grouped_bar_plot, heat_map, stacked_bar_plot, histogram_plot, quantile_band_plot, \
+    grouped_summary_plot
+
+# above this size AUTO switches to plots whose cost depends on the number of bins, not of nodes
+AGGREGATE_PLOT_NODES = 1000
+# above this size bootstrap nodes are summarized instead of drawn one bar series each
+GROUPED_BAR_MAX_BNS = 10
+QUANTILE_LEVELS = (0.05, 0.25, 0.5, 0.75, 0.95)
 
 
 class Behavior(Enum):
@@ -14,6 +27,13 @@ class Behavior(Enum):
     BYZANTINE = 1
 
 
+class PlotMode(Enum):
+    AUTO = 0
+    VIOLIN = 1
+    HISTOGRAM = 2
+    QUANTILE = 3
+
+
 @dataclass(unsafe_hash=True)
 class TradeInstance:
     sender: int
@@ -37,10 +57,18 @@ class Analyzer:
     # index is epoch, each inside dict consist of key: fn_id, value: mempool size
     mempools: Dict[int, Dict[int, int]] = field(init=False, default_factory=dict)
     peer_lists: Dict[int, Dict[int, List[int]]] = field(init=False, default_factory=dict)
+    # files holding history moved out of memory, in epoch order, inside a directory owned by this run
+    spilled: List[str] = field(init=False, default_factory=list)
+    spill_run_dir: str = field(init=False, default=None)
+    plot_mode: PlotMode = field(init=False, default=PlotMode.AUTO)
+    plot_bins: int = field(init=False, default=50)
 
-    def init(self, fns: List[FullNode], bns: List[BootstrapNode]):
+    def init(self, fns: List[FullNode], bns: List[BootstrapNode], plot_mode: PlotMode = PlotMode.AUTO,
+             plot_bins: int = 50):
         self.fns = fns
         self.bns = bns
+        self.plot_mode = plot_mode
+        self.plot_bins = plot_bins
 
     def add_peer_lists(self, epoch: int):
         if epoch not in self.peer_lists: self.peer_lists[epoch] = {}
@@ -75,26 +103,129 @@ class Analyzer:
         for fn in self.fns:
             self.mempools[epoch][fn.id] = len(fn.mempool)
 
+    def has_history(self):
+        return len(self.trades) > 0 or len(self.exchages) > 0 or len(self.mempools) > 0 or len(self.peer_lists) > 0
+
+    def spill_history(self, spill_dir: str, epoch: int):
+        if self.spill_run_dir is None:
+            os.makedirs(spill_dir, exist_ok=True)
+            self.spill_run_dir = tempfile.mkdtemp(prefix='history_', dir=spill_dir)
+        path = os.path.join(self.spill_run_dir, '{:06d}.pickle'.format(epoch))
+        with open(path, 'wb') as f:
+            pickle.dump((self.exchages, self.trades, self.mempools, self.peer_lists), f,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        self.spilled.append(path)
+        self.exchages, self.trades, self.mempools, self.peer_lists = {}, {}, {}, {}
+
+    def discard_spilled(self):
+        if self.spill_run_dir is not None:
+            shutil.rmtree(self.spill_run_dir, ignore_errors=True)
+        self.spill_run_dir = None
+        self.spilled = []
+
+    def _history_chunks(self):
+        """Loads the spilled history one chunk at a time in place of the current one, then restores it."""
+        current = self.exchages, self.trades, self.mempools, self.peer_lists
+        try:
+            for path in self.spilled:
+                with open(path, 'rb') as f:
+                    self.exchages, self.trades, self.mempools, self.peer_lists = pickle.load(f)
+                yield
+            self.exchages, self.trades, self.mempools, self.peer_lists = current
+            yield
+        finally:
+            self.exchages, self.trades, self.mempools, self.peer_lists = current
+
+    def collect_per_epoch(self):
+        """Computes every per-epoch aggregate, never holding more than one spilled chunk in memory."""
+        peers = [[] for _ in self.bns]
+        mempools, trades, duplicates, exchange_types = [], [], [], [[], [], []]
+        for _ in self._history_chunks():
+            for bn_peers, chunk in zip(peers, self.fn_distribution_per_bn_and_epoch()[0]):
+                bn_peers.extend(chunk)
+            mempools.extend(self.mempool_per_epoch_size_plot()[0])
+            trades.extend(self.number_of_trade_per_epoch()[0])
+            duplicates.extend(self.duplicates_per_epoch()[0])
+            for types, chunk in zip(exchange_types, self.exchange_type_per_epoch()[0]):
+                types.extend(chunk)
+        return peers, mempools, trades, duplicates, exchange_types
+
     def analyze(self):
         print("Start analyzing ...")
+        peers, mempools, trades, duplicates, exchange_types = self.collect_per_epoch()
+        self.discard_spilled()
 
-        x, y = self.fn_distribution_per_bn_and_epoch()
-        grouped_bar_plot(x, y, 'Number of peer per epoch per bootstrap node', 'Peer registered', 'Epoch',
-                         ('BN6', 'BN1', 'BN2', 'BN3', 'BN4', 'BN5'))
+        epochs = list(range(len(mempools)))
+        if self._summarize_bns():
+            grouped_summary_plot(peers, epochs, 'Number of peer per epoch per bootstrap node', 'Peer registered',
+                                 'Epoch')
+        else:
+            grouped_bar_plot(peers, epochs, 'Number of peer per epoch per bootstrap node', 'Peer registered', 'Epoch',
+                             self.bn_labels())
 
-        y, x = self.mempool_per_epoch_size_plot()
-        violin_plot(y, x, 'Global view of network mempools', 'Mempool sizes', 'Epoch')
+        self._distribution_plot(mempools, epochs, 'Global view of network mempools', 'Mempool sizes', 'Epoch')
+        self._distribution_plot(trades, epochs, 'Peer\'s exchange number per epoch', 'Exchange number', 'Epoch')
+        self._distribution_plot(duplicates, epochs, 'Number of duplicates per epoch', 'Duplicates number', 'Epoch')
+        stacked_bar_plot(exchange_types, ['BAL', 'OPT', 'ABORT'], epochs)
 
-        y, x = self.number_of_trade_per_epoch()
-        violin_plot(y, x, 'Peer\'s exchange number per epoch', 'Exchange number', 'Epoch')
+    def bn_labels(self):
+        return tuple('BN{}'.format(bn.id) for bn in self.bns)
 
-        y, x = self.duplicates_per_epoch()
-        violin_plot(y, x, 'Number of duplicates per epoch', 'Duplicates number', 'Epoch')
+    def _summarize_bns(self):
+        # one bar series per bootstrap node stays readable only for a few of them, whatever the plot mode
+        return len(self.bns) > GROUPED_BAR_MAX_BNS
 
-        x, y = self.exchange_type_per_epoch()
-        stacked_bar_plot(x, ['BAL', 'OPT', 'ABORT'], y)
+    def _distribution_plot(self, data, pos, title, y_label, x_label):
+        mode = self.plot_mode
+        if mode == PlotMode.AUTO:
+            mode = PlotMode.VIOLIN if len(self.fns) <= AGGREGATE_PLOT_NODES else PlotMode.HISTOGRAM
+        if mode == PlotMode.VIOLIN:
+            violin_plot(data, pos, title, y_label, x_label)
+            return
+
+        counts, edges, avg = self.bin_per_epoch(data, self.plot_bins)
+        if mode == PlotMode.HISTOGRAM:
+            histogram_plot(counts, edges, pos, title, y_label, x_label, avg)
+        else:
+            quantiles = self.histogram_quantiles(counts, edges, QUANTILE_LEVELS)
+            quantile_band_plot(quantiles, QUANTILE_LEVELS, pos, title, y_label, x_label, avg)
 
     # DATA_MANIPULATION
+    @staticmethod
+    def bin_per_epoch(data, bins: int):
+        """Bins the values of every epoch over shared edges, returns counts (epochs x at most bins), edges and means."""
+        data = [np.asarray(values, dtype=float) for values in data]
+        non_empty = [values for values in data if len(values)]
+        lo = min(values.min() for values in non_empty) if non_empty else 0
+        hi = max(values.max() for values in non_empty) if non_empty else 0
+        if all(np.array_equal(values, np.round(values)) for values in non_empty) and hi - lo < bins:
+            # one bin per integer, float spaced edges would leave most bins empty
+            edges = np.arange(lo, hi + 2) - 0.5
+        else:
+            edges = np.linspace(lo, hi if hi > lo else lo + 1, bins + 1)
+        counts = np.stack([np.histogram(values, edges)[0] for values in data])
+        avg = [values.mean() if len(values) else np.nan for values in data]
+        return counts, edges, avg
+
+    @staticmethod
+    def histogram_quantiles(counts, edges, levels: Tuple):
+        """Interpolates quantiles (epochs x levels) from binned counts, linearly inside each bin."""
+        counts = np.asarray(counts, dtype=float)
+        cdf = np.cumsum(counts, axis=1)
+        totals = cdf[:, -1:]
+        cdf = np.divide(cdf, totals, out=np.zeros_like(cdf), where=totals > 0)
+        rows = np.arange(len(counts))
+        quantiles = np.empty((len(counts), len(levels)))
+        for j, level in enumerate(levels):
+            # first bin reaching the level
+            idx = (cdf < level).sum(axis=1).clip(0, counts.shape[1] - 1)
+            prev = np.where(idx > 0, cdf[rows, idx - 1], 0)
+            width = cdf[rows, idx] - prev
+            frac = np.divide(level - prev, width, out=np.zeros_like(prev), where=width > 0).clip(0, 1)
+            quantiles[:, j] = edges[idx] + frac * (edges[idx + 1] - edges[idx])
+        quantiles[totals[:, 0] == 0] = np.nan
+        return quantiles
+
     def mempool_per_epoch_size_plot(self):
         return [list(mempool.values()) for mempool in self.mempools.values()], list(range(len(self.mempools.values())))
 
@@ -103,33 +234,33 @@ class Analyzer:
         for bn in self.bns:
             for epoch in self.peer_lists.keys():
                 data[bn.id].append(len(self.peer_lists[epoch][bn.id]))
-        return data, list(range(len(data[0])))
+        return data, list(range(len(self.peer_lists)))
 
     def number_of_trade_per_epoch(self):
         data = [[] for _ in self.exchages.keys()]
-        for epoch in self.exchages.keys():
+        for idx, epoch in enumerate(self.exchages.keys()):
             for exchange in self.exchages[epoch].values():
                 to_add = 0
                 for exchange_id in exchange:
                     if self.trades[exchange_id].exchange_type != Exchange.ABORT:
                         to_add += 1
-                data[epoch].append(to_add)
+                data[idx].append(to_add)
         return data, list(range(len(self.exchages.keys())))
 
     def duplicates_per_epoch(self):
         data = [[] for _ in self.exchages.keys()]
-        for epoch in self.exchages.keys():
+        for idx, epoch in enumerate(self.exchages.keys()):
             epoch_trade = set()
             for peer_trades in self.exchages[epoch].values():
                 for trade_id in peer_trades:
                     epoch_trade.add(self.trades[trade_id])
             for trade in epoch_trade:
                 if trade.receiver_duplicates >= 0:
-                    data[epoch].append(trade.receiver_duplicates)
+                    data[idx].append(trade.receiver_duplicates)
                 if trade.sender_duplicates >= 0:
-                    data[epoch].append(trade.sender_duplicates)
-                if len(data[epoch]) == 0:
-                    data[epoch].append(0)
+                    data[idx].append(trade.sender_duplicates)
+                if len(data[idx]) == 0:
+                    data[idx].append(0)
         return data, list(range(len(self.exchages.keys())))
 
     def exchange_type_per_epoch(self):
@@ -46,7 +46,8 @@ class FullNode:
 
     def set_mempool(self, mempool: List[str]):
         self.mempool = set(mempool)
-        self.frozen_mempool = deepcopy(self.mempool)
+        # txs are immutable strings, a shallow copy is enough
+        self.frozen_mempool = self.mempool.copy()
 
     def set_subscriptions(self, ids: List[int]):
         self.subscriptions = ids
@@ -0,0 +1,179 @@
+import sys
+import tracemalloc
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Dict, List, Optional, Tuple
+
+from analyzer import Analyzer
+from fullnode import FullNode
+
+MB = 1024 * 1024
+
+
+class BudgetAction(Enum):
+    SPILL = 0
+    ABORT = 1
+
+
+class MemoryBudgetExceeded(Exception):
+
+    def __init__(self, report):
+        super().__init__('memory budget exceeded at epoch {}'.format(report.epoch))
+        self.report = report
+
+
+def deep_sizeof(obj, seen=None) -> int:
+    """Approximate number of bytes reachable from obj, counting every object once."""
+    seen = set() if seen is None else seen
+    size = 0
+    stack = [obj]
+    while stack:
+        o = stack.pop()
+        if id(o) in seen or isinstance(o, Enum):
+            continue
+        seen.add(id(o))
+        size += sys.getsizeof(o)
+        if isinstance(o, dict):
+            stack.extend(o.keys())
+            stack.extend(o.values())
+        elif isinstance(o, (list, tuple, set, frozenset)):
+            stack.extend(o)
+        elif hasattr(o, '__dict__'):
+            stack.append(o.__dict__)
+    return size
+
+
+def _estimate_mapping(d: Dict, sample: int = 32) -> int:
+    # every entry of the mapping has the same shape, so extrapolate from a few of them
+    if not d:
+        return sys.getsizeof(d)
+    items = []
+    for item in d.items():
+        items.append(item)
+        if len(items) == sample:
+            break
+    per_item = deep_sizeof(items) - sys.getsizeof(items)
+    return sys.getsizeof(d) + per_item * len(d) // len(items)
+
+
+@dataclass
+class MemoryReport:
+    epoch: int
+    # subsystem -> estimated bytes
+    subsystems: Dict[str, int]
+    traced_current: int = -1
+    traced_peak: int = -1
+    top_allocations: List[str] = field(default_factory=list)
+    spilled: bool = False
+    # directory still holding the spilled history when the run is aborted
+    spill_dir: str = None
+
+    @property
+    def total(self):
+        return sum(self.subsystems.values())
+
+    def __str__(self):
+        lines = ['Memory at epoch {}: {:.2f} MB estimated'.format(self.epoch, self.total / MB)]
+        for name, size in sorted(self.subsystems.items(), key=lambda x: -x[1]):
+            lines.append('  {:<22} {:>10.2f} MB'.format(name, size / MB))
+        if self.traced_current >= 0:
+            lines.append('  tracemalloc current {:.2f} MB, peak {:.2f} MB'.format(self.traced_current / MB,
+                                                                                 self.traced_peak / MB))
+        lines.extend('    ' + line for line in self.top_allocations)
+        if self.spilled:
+            lines.append('  analyzer history spilled to disk')
+        if self.spill_dir:
+            lines.append('  history of earlier epochs kept in {}'.format(self.spill_dir))
+        return '\n'.join(lines)
+
+
+@dataclass
+class MemoryAccountant:
+    # 0 disables the budget guard
+    budget: int = 0
+    action: BudgetAction = BudgetAction.SPILL
+    spill_dir: str = 'spill'
+    # take a tracemalloc snapshot every n epochs, 0 disables tracemalloc
+    tracemalloc_every: int = 0
+    tracemalloc_top: int = 5
+    verbose: bool = False
+    reports: List[MemoryReport] = field(init=False, default_factory=list)
+    # history of completed epochs never changes, so their sizes are computed once
+    _history_sizes: Dict[str, Dict[int, int]] = field(init=False, default_factory=dict)
+
+    @classmethod
+    def from_config(cls, config):
+        action = config.get('MEMORY_BUDGET_ACTION') or 'SPILL'
+        return cls(budget=int((config.get('MEMORY_BUDGET_MB') or 0) * MB),
+                   action=BudgetAction[action.upper()],
+                   spill_dir=config.get('MEMORY_SPILL_DIR') or 'spill',
+                   tracemalloc_every=config.get('MEMORY_TRACEMALLOC_EVERY') or 0,
+                   verbose=bool(config.get('MEMORY_REPORT')))
+
+    def start(self):
+        if self.tracemalloc_every > 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def stop(self):
+        if self.tracemalloc_every > 0 and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def _history_size(self, name: str, history: Dict[int, Dict]) -> int:
+        cache = self._history_sizes.setdefault(name, {})
+        size = sys.getsizeof(history)
+        last = max(history.keys()) if history else -1
+        for epoch, per_epoch in history.items():
+            if epoch in cache:
+                size += cache[epoch]
+                continue
+            epoch_size = sys.getsizeof(per_epoch) + sum(sys.getsizeof(v) for v in per_epoch.values())
+            # the last epoch can still grow
+            if epoch != last:
+                cache[epoch] = epoch_size
+            size += epoch_size
+        return size
+
+    def estimate(self, fns: List[FullNode], analyzer: Analyzer) -> Dict[str, int]:
+        # mempools only hold references to the shared transaction strings, so count the containers
+        return {
+            'mempools': sum(sys.getsizeof(fn.mempool) for fn in fns),
+            'frozen_mempools': sum(sys.getsizeof(fn.frozen_mempool) for fn in fns),
+            'analyzer.trades': _estimate_mapping(analyzer.trades),
+            'analyzer.exchanges': self._history_size('exchanges', analyzer.exchages),
+            'analyzer.peer_lists': self._history_size('peer_lists', analyzer.peer_lists),
+            'analyzer.mempools': self._history_size('mempools', analyzer.mempools),
+        }
+
+    def _trace(self, epoch: int, report: MemoryReport):
+        if not tracemalloc.is_tracing():
+            return
+        report.traced_current, report.traced_peak = tracemalloc.get_traced_memory()
+        if epoch % self.tracemalloc_every == 0:
+            stats = tracemalloc.take_snapshot().statistics('lineno')
+            report.top_allocations = [str(stat) for stat in stats[:self.tracemalloc_top]]
+
+    def account(self, epoch: int, fns: List[FullNode], analyzer: Analyzer) -> MemoryReport:
+        report = MemoryReport(epoch, self.estimate(fns, analyzer))
+        self._trace(epoch, report)
+
+        if self.budget and report.total > self.budget:
+            if self.action == BudgetAction.SPILL and analyzer.has_history():
+                analyzer.spill_history(self.spill_dir, epoch)
+                self._history_sizes = {}
+                report = MemoryReport(epoch, self.estimate(fns, analyzer), report.traced_current,
+                                      report.traced_peak, report.top_allocations, spilled=True)
+            if report.total > self.budget:
+                report.spill_dir = analyzer.spill_run_dir
+                self.reports.append(report)
+                raise MemoryBudgetExceeded(report)
+
+        self.reports.append(report)
+        if self.verbose: print(report)
+        return report
+
+    def peak(self) -> Optional[Tuple[int, int]]:
+        if not self.reports:
+            return None
+        report = max(self.reports, key=lambda r: r.total)
+        return report.epoch, report.total
+
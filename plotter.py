@@ -28,6 +28,68 @@ def violin_plot(data: List, pos: List[int], title: str, y_label: str, x_label: s
     fig.savefig('simulations/' + uuid.uuid4().hex + ".png", dpi=(250), bbox_inches='tight')
 
 
+def histogram_plot(counts, edges, pos: List[int], title: str, y_label: str, x_label: str, avg: List = None):
+    """Plots one precomputed histogram per epoch as a column of a heat map.
+
+    counts -- 2-dimensional array (epochs x bins) of value counts
+    edges  -- bin edges shared by every epoch (bins + 1)
+    avg    -- optional mean per epoch, drawn on top
+    """
+    counts = np.asarray(counts, dtype=float)
+    pos = np.asarray(pos, dtype=float)
+    step = pos[1] - pos[0] if len(pos) > 1 else 1
+    x_edges = np.append(pos - step / 2, pos[-1] + step / 2)
+    # normalize each epoch so that columns are comparable whatever the number of nodes
+    totals = counts.sum(axis=1, keepdims=True)
+    density = np.divide(counts, totals, out=np.zeros_like(counts), where=totals > 0)
+
+    fig, ax = plt.subplots()
+    mesh = ax.pcolormesh(x_edges, edges, density.T, cmap='viridis')
+    fig.colorbar(mesh, ax=ax, label='Fraction of nodes')
+    if avg is not None: ax.plot(pos, avg, label='Mean', linestyle='--', color='w')
+    ax.set(xlabel=x_label, ylabel=y_label, title=title)
+    fig.show()
+    fig.savefig('simulations/' + uuid.uuid4().hex + ".png", dpi=(250), bbox_inches='tight')
+
+
+def quantile_band_plot(quantiles, levels: Tuple, pos: List[int], title: str, y_label: str, x_label: str,
+                       avg: List = None):
+    """Plots the median and shaded bands between symmetric quantiles.
+
+    quantiles -- 2-dimensional array (epochs x levels)
+    levels    -- increasing quantile levels, e.g. (0.05, 0.25, 0.5, 0.75, 0.95)
+    avg       -- optional mean per epoch, drawn on top
+    """
+    quantiles = np.asarray(quantiles, dtype=float)
+    n_bands = len(levels) // 2
+
+    fig, ax = plt.subplots()
+    for band in range(n_bands):
+        lo, hi = band, len(levels) - 1 - band
+        ax.fill_between(pos, quantiles[:, lo], quantiles[:, hi], alpha=0.2 + 0.5 * band / max(n_bands, 1),
+                        color='C0', linewidth=0,
+                        label='{:g}-{:g}%'.format(levels[lo] * 100, levels[hi] * 100))
+    if len(levels) % 2:
+        ax.plot(pos, quantiles[:, n_bands], color='C0', label='Median')
+    if avg is not None: ax.plot(pos, avg, label='Mean', linestyle='--', color='C1')
+    ax.set(xlabel=x_label, ylabel=y_label, title=title)
+    ax.legend()
+    fig.show()
+    fig.savefig('simulations/' + uuid.uuid4().hex + ".png", dpi=(250), bbox_inches='tight')
+
+
+def grouped_summary_plot(data, pos: List[int], title: str, y_label: str, x_label: str):
+    """Summarizes many series (e.g. one per bootstrap node) with their spread per epoch.
+
+    data -- 2-dimensional array (series x epochs)
+    """
+    data = np.asarray(data, dtype=float)
+    levels = (0, 0.25, 0.5, 0.75, 1)
+    quantiles = np.quantile(data, levels, axis=0).T
+    quantile_band_plot(quantiles, levels, pos, title + ' ({} series)'.format(len(data)), y_label, x_label,
+                       data.mean(axis=0))
+
+
 def grouped_bar_plot(data, pos, title: str, y_label: str, x_label: str, legend: Tuple = None):
     number_of_observations = 10
     if number_of_observations < len(data[0]):
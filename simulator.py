@@ -3,10 +3,14 @@ from dataclasses import field, dataclass
 from math import ceil, floor
 from typing import List, Dict
 
-from analyzer import Analyzer, Behavior
+import numpy as np
+
+from analyzer import Analyzer, Behavior, PlotMode
 from bootstrapnode import BootstrapNode
 from config import Config
 from fullnode import FullNode, Exchange
+from memory import MemoryAccountant, MemoryBudgetExceeded, MB
+from world import World, WorldBuilder
 
 
 @dataclass
@@ -20,14 +24,23 @@ class Simulator:
     r = random
     glob_unique_txs = 0
     analyzer: Analyzer = Analyzer()
+    memory: MemoryAccountant = field(init=False)
+    world: World = field(init=False, default=None)
 
     def __post_init__(self):
         self._read_config()
+        self.memory = MemoryAccountant.from_config(self.config)
+        # trace the generated txs and initial mempools too, they hold most of the memory
+        self.memory.start()
         self._set_random()
-        self._generate_txs()
-        self._generate_bns()
-        self._generate_fns()
-        self.analyzer.init(self.fns, self.bns)
+        if self.config.get('FAST_WORLD_INIT'):
+            self._build_world()
+        else:
+            self._generate_txs()
+            self._generate_bns()
+            self._generate_fns()
+        self.analyzer.init(self.fns, self.bns, PlotMode[(self.config.get('PLOT_MODE') or 'AUTO').upper()],
+                           self.config.get('PLOT_BINS') or 50)
 
     def start_simulation(self):
         self._print_starting_sentence()
@@ -84,8 +97,17 @@ class Simulator:
                                                      partner_mem_size, bn.id, Behavior.PROTOCOL)
 
             self.print_mempool_state()
+            try:
+                self.memory.account(epoch, self.fns, self.analyzer)
+            except MemoryBudgetExceeded as e:
+                print('Aborting simulation: {}'.format(e))
+                print(e.report)
+                self.memory.stop()
+                return
             print('Done epoch {}'.format(epoch))
+        self.memory.stop()
         print('Done simulation')
+        self._print_memory_peak()
         self.analyzer.analyze()
 
     def _generate_txs(self):
@@ -147,21 +169,50 @@ class Simulator:
         node_number = self.config.get('FULL_NODE_TOTAL')
         byzantine_number = self.config.get('BYZANTINE_FULL_NODES')
         rational_number = self.config.get('RATIONAL_FULL_NODES')
-        max_bal = self.config.get('MAX_BAL_EX')
-        max_opt = self.config.get('MAX_OPT_EX')
         assert (node_number >= byzantine_number + rational_number)
 
         for id in range(node_number):
             mempool = self.get_txs_set()
             subscriptions = self.get_subscriptions(id)
-            fn = FullNode(id, max_bal, max_opt)
-            if id < byzantine_number:
-                fn.set_byzantine()
-            elif id < byzantine_number + rational_number:
-                fn.set_rational()
-            fn.set_mempool(mempool)
-            fn.set_subscriptions(subscriptions)
-            self.fns.append(fn)
+            self.fns.append(self._create_fn(id, mempool, subscriptions))
+
+    def _create_fn(self, id, mempool, subscriptions):
+        byzantine_number = self.config.get('BYZANTINE_FULL_NODES')
+        rational_number = self.config.get('RATIONAL_FULL_NODES')
+        max_bal = self.config.get('MAX_BAL_EX')
+        max_opt = self.config.get('MAX_OPT_EX')
+
+        fn = FullNode(id, max_bal, max_opt)
+        if id < byzantine_number:
+            fn.set_byzantine()
+        elif id < byzantine_number + rational_number:
+            fn.set_rational()
+        fn.set_mempool(mempool)
+        fn.set_subscriptions(subscriptions)
+        return fn
+
+    def _build_world(self):
+        node_number = self.config.get('FULL_NODE_TOTAL')
+        byzantine_number = self.config.get('BYZANTINE_FULL_NODES')
+        rational_number = self.config.get('RATIONAL_FULL_NODES')
+        assert (node_number >= byzantine_number + rational_number)
+
+        self.world = WorldBuilder(self.config, self.config.get('WORLD_CACHE_DIR') or 'worlds').build()
+        # only txs sitting in some mempool are ever exchanged, the others are never turned into strings
+        referenced = self.world.referenced_txs()
+        self.data = self.world.tx_strings(referenced)
+        txs = np.empty(len(self.world.tx_sizes), dtype=object)
+        txs[referenced] = self.data
+        mempools = txs[self.world.mempool_indices].tolist()
+        mempool_indptr = self.world.mempool_indptr.tolist()
+        self._generate_bns()
+
+        subscriptions = self.world.subscriptions.tolist()
+        for id in range(node_number):
+            for bn_id in subscriptions[id]:
+                self.bns[bn_id].set_peer(id)
+            mempool = mempools[mempool_indptr[id]:mempool_indptr[id + 1]]
+            self.fns.append(self._create_fn(id, mempool, subscriptions[id]))
 
     def _print_starting_sentence(self):
         bn_number = self.config.get('BOOTSTRAP_NODE_TOTAL')
@@ -171,7 +222,12 @@ class Simulator:
         epochs = self.config.get('EPOCHS')
         mempool_number = self.config.get('MEMPOOL_TOTAL')
 
-        self.glob_unique_txs = len(set(sum([list(fn.mempool) for fn in self.fns], [])))
+        if self.world is not None:
+            self.glob_unique_txs = self.world.unique_txs()
+            mempool_sizes = self.world.mempool_sizes()
+        else:
+            self.glob_unique_txs = len(set().union(*(fn.mempool for fn in self.fns)))
+            mempool_sizes = [len(fn.mempool) for fn in self.fns]
 
         print("Starting simulation with:"
               "\n- {} bootstrap nodes"
@@ -181,7 +237,12 @@ class Simulator:
               "\n- {} mempool mean size"
               .format(bn_number, node_number, byzantine_number, rational_number, self.glob_unique_txs, epochs,
                       mempool_number))
-        print("Min mempool: {}, Max mempool {}".format(min([len(fn.mempool) for fn in self.fns]), max([len(fn.mempool) for fn in self.fns])))
+        print("Min mempool: {}, Max mempool {}".format(min(mempool_sizes), max(mempool_sizes)))
+
+    def _print_memory_peak(self):
+        peak = self.memory.peak()
+        if peak:
+            print('Peak tracked memory: {:.2f} MB at epoch {}'.format(peak[1] / MB, peak[0]))
 
     def add_redeemed_peers(self):
         for bn in self.bns:
@@ -0,0 +1,135 @@
+import hashlib
+import json
+import os
+import shutil
+from dataclasses import dataclass
+from typing import List
+
+import numpy as np
+
+from config import Config
+
+WORLD_VERSION = 2
+# only these parameters shape the generated world, epoch-loop parameters can change freely
+GENERATION_KEYS = ('TX_TOTAL', 'TX_MEAN_SIZE', 'TX_STDEV_SIZE', 'BOOTSTRAP_NODE_TOTAL', 'FULL_NODE_TOTAL',
+                   'MEMPOOL_TOTAL', 'MEMPOOL_STD', 'SUBSCRIPTION_TOTAL', 'SEED')
+
+
+@dataclass
+class World:
+    # tx_id -> random bytes of the tx, zero padded to the biggest tx
+    tx_bytes: np.ndarray
+    tx_sizes: np.ndarray
+    # mempool of full node i is mempool_indices[mempool_indptr[i]:mempool_indptr[i + 1]]
+    mempool_indptr: np.ndarray
+    mempool_indices: np.ndarray
+    # full_node_id -> bootstrap node ids
+    subscriptions: np.ndarray
+
+    def tx_strings(self, tx_ids: np.ndarray) -> List[str]:
+        # a single hex conversion of the selected rows, then one slice per tx
+        width = 2 * self.tx_bytes.shape[1]
+        content = self.tx_bytes[tx_ids].tobytes().hex()
+        return [content[i * width:i * width + 2 * size] for i, size in enumerate(self.tx_sizes[tx_ids].tolist())]
+
+    def mempool_sizes(self) -> np.ndarray:
+        return np.diff(self.mempool_indptr)
+
+    def referenced_txs(self) -> np.ndarray:
+        seen = np.zeros(len(self.tx_sizes), dtype=bool)
+        seen[self.mempool_indices] = True
+        return np.flatnonzero(seen)
+
+    def unique_txs(self) -> int:
+        return len(self.referenced_txs())
+
+    def save(self, path: str):
+        os.makedirs(path)
+        for name, array in vars(self).items():
+            np.save(os.path.join(path, name + '.npy'), array)
+
+    @classmethod
+    def load(cls, path: str):
+        return cls(**{name: np.load(os.path.join(path, name + '.npy'), mmap_mode='r')
+                      for name in cls.__dataclass_fields__})
+
+
+def sample_rows(rng: np.random.Generator, population: int, sizes: np.ndarray) -> np.ndarray:
+    """Draws sizes[i] distinct values out of range(population) for every row i, concatenated row after row."""
+    sizes = np.asarray(sizes, dtype=np.int64)
+    row_of = np.repeat(np.arange(len(sizes)), sizes)
+    out = np.empty(len(row_of), dtype=np.int64)
+    if len(out) == 0:
+        return out.astype(np.int32)
+    offsets = np.cumsum(sizes) - sizes
+
+    # rows asking for most of the population would redraw for long, a permutation is O(k) there
+    dense = sizes * 2 > population
+    for row in np.flatnonzero(dense).tolist():
+        out[offsets[row]:offsets[row] + sizes[row]] = rng.permutation(population)[:sizes[row]]
+
+    # draw with replacement, then redraw the duplicates of every row until none is left
+    todo = np.flatnonzero(~dense[row_of])
+    out[todo] = rng.integers(0, population, len(todo))
+    while len(todo):
+        keys = row_of[todo] * population + out[todo]
+        order = np.argsort(keys, kind='stable')
+        duplicate = np.zeros(len(todo), dtype=bool)
+        duplicate[order[1:]] = keys[order[1:]] == keys[order[:-1]]
+        redraw = todo[duplicate]
+        out[redraw] = rng.integers(0, population, len(redraw))
+        todo = todo[np.isin(row_of[todo], row_of[redraw])]
+    return out.astype(np.int32)
+
+
+@dataclass
+class WorldBuilder:
+    config: Config
+    cache_dir: str = 'worlds'
+
+    def key(self) -> str:
+        params = {key: self.config.get(key) for key in GENERATION_KEYS}
+        params['VERSION'] = WORLD_VERSION
+        return hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()[:16]
+
+    def path(self) -> str:
+        return os.path.join(self.cache_dir, self.key())
+
+    def build(self) -> World:
+        path = self.path()
+        if not os.path.isdir(path):
+            tmp = '{}.tmp-{}'.format(path, os.getpid())
+            shutil.rmtree(tmp, ignore_errors=True)
+            self.generate().save(tmp)
+            try:
+                os.rename(tmp, path)
+            except OSError:
+                # another run cached the same world meanwhile
+                shutil.rmtree(tmp, ignore_errors=True)
+        return World.load(path)
+
+    def generate(self) -> World:
+        tx_number = self.config.get('TX_TOTAL')
+        bn_number = self.config.get('BOOTSTRAP_NODE_TOTAL')
+        node_number = self.config.get('FULL_NODE_TOTAL')
+        subscription_number = self.config.get('SUBSCRIPTION_TOTAL')
+        rng = np.random.default_rng(self.config.get('SEED'))
+
+        tx_sizes = np.ceil(rng.normal(self.config.get('TX_MEAN_SIZE'), self.config.get('TX_STDEV_SIZE'), tx_number))
+        tx_sizes = tx_sizes.clip(0).astype(np.int64)
+        tx_bytes = rng.integers(0, 256, (tx_number, int(tx_sizes.max()) if tx_number else 0), dtype=np.uint8)
+
+        mempool_sizes = np.floor(rng.normal(self.config.get('MEMPOOL_TOTAL'), self.config.get('MEMPOOL_STD'),
+                                            node_number))
+        mempool_sizes = mempool_sizes.clip(0, tx_number).astype(np.int64)
+        mempool_indptr = np.zeros(node_number + 1, dtype=np.int64)
+        np.cumsum(mempool_sizes, out=mempool_indptr[1:])
+        mempool_indices = sample_rows(rng, tx_number, mempool_sizes)
+
+        if subscription_number == bn_number:
+            subscriptions = np.tile(np.arange(bn_number, dtype=np.int32), (node_number, 1))
+        else:
+            subscriptions = sample_rows(rng, bn_number, np.full(node_number, subscription_number))
+            subscriptions = subscriptions.reshape(node_number, subscription_number)
+
+        return World(tx_bytes, tx_sizes, mempool_indptr, mempool_indices, subscriptions)